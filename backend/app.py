@@ -1,31 +1,66 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, current_app, request, jsonify, send_from_directory
 from flask_cors import CORS
 import base64
+import importlib
 import os
 import sys
 import hashlib
-import gzip
-import re
+import threading
 from datetime import datetime
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from crypto import aes_gcm
-from crypto import rsa_utils
 import json
 
 import pathlib
+from backend import password_strength, state
 FRONTEND_DIR = pathlib.Path(__file__).parent.parent / 'frontend'
-app = Flask(__name__)
-CORS(app)
 
-# Production configuration
-if os.environ.get('FLASK_ENV') == 'production':
-    app.config['DEBUG'] = False
-else:
-    app.config['DEBUG'] = True
 
-# --- Session-Only Audit Log (NEW) ---
-audit_log = []
+class _LazyModule:
+    """Import a module on first attribute access.
+
+    The crypto modules pull in the `cryptography` hazmat backends, which
+    dominate worker start-up time. Deferring them lets a cold worker answer
+    its first request before any key material is needed.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+aes_gcm = _LazyModule('crypto.aes_gcm')
+rsa_utils = _LazyModule('crypto.rsa_utils')
+
+MAX_BULK_PASSWORDS = 10_000  # per request; larger audits should call score_passwords directly
+MAX_REKEY_ENVELOPES = 100  # two PBKDF2 runs each; larger rotations should call rekey_many directly
+
+api = Blueprint('api', __name__)
+
+# --- Session Audit Log and Metrics (shared via the state store) ---
+def get_store() -> state.StateStore:
+    """Return the state store of the current app."""
+    return current_app.extensions['state']
+
+
+def get_key_cache():
+    """Return the derived-key cache, or None when disabled."""
+    ttl = current_app.config['DERIVED_KEY_CACHE_TTL']
+    if not ttl:
+        return None
+    secret = current_app.config.get('SECRET_KEY')
+    return state.DerivedKeyCache(get_store(), ttl, secret.encode() if isinstance(secret, str) else secret)
+
+
+def get_breach_list():
+    """Return the memory-mapped breach list, or None when not configured."""
+    return current_app.extensions['breach_list']
+
 
 def log_operation(operation: str, method: str, success: bool, error_msg: str = None, details: dict = None):
     """Log encryption operation without storing plaintext."""
@@ -37,10 +72,10 @@ def log_operation(operation: str, method: str, success: bool, error_msg: str = N
         'error': error_msg,
         'details': details or {}
     }
-    audit_log.append(log_entry)
-    # Keep only last 100 entries
-    if len(audit_log) > 100:
-        audit_log.pop(0)
+    store = get_store()
+    store.append_log(log_entry)
+    store.incr('operations_total')
+    store.incr(f'{method}.success' if success else f'{method}.failure')
 
 def validate_password_strength(password: str) -> tuple[bool, str]:
     """Validate password meets minimum requirements."""
@@ -51,14 +86,14 @@ def validate_password_strength(password: str) -> tuple[bool, str]:
     return True, 'Password strength is good'
 
 # --- RSA Endpoints ---
-@app.route('/api/generate_rsa_keys', methods=['GET'])
+@api.route('/api/generate_rsa_keys', methods=['GET'])
 def generate_rsa_keys():
-    priv, pub = rsa_utils.generate_key_pair()
+    priv, pub = rsa_utils.pooled_key_pair()
     fingerprint = rsa_utils.compute_key_fingerprint(pub)
     log_operation('Generate RSA Keys', 'RSA', True, details={'fingerprint': fingerprint})
     return jsonify({'private_key': priv, 'public_key': pub, 'fingerprint': fingerprint})
 
-@app.route('/api/rsa_encrypt', methods=['POST'])
+@api.route('/api/rsa_encrypt', methods=['POST'])
 def rsa_encrypt():
     data = request.get_json()
     plaintext = data.get('plaintext', '')
@@ -75,7 +110,7 @@ def rsa_encrypt():
         log_operation('Encrypt (RSA Hybrid)', 'RSA Hybrid', False, str(e))
         return jsonify({'error': f'RSA encryption failed: {e}'}), 500
 
-@app.route('/api/rsa_decrypt', methods=['POST'])
+@api.route('/api/rsa_decrypt', methods=['POST'])
 def rsa_decrypt():
     data = request.get_json()
     ciphertext = data.get('ciphertext', '')
@@ -92,12 +127,13 @@ def rsa_decrypt():
         return jsonify({'error': f'RSA decryption failed: {e}'}), 500
 
 # --- AES-GCM Endpoints ---
-@app.route('/api/encrypt', methods=['POST'])
+@api.route('/api/encrypt', methods=['POST'])
 def encrypt():
     data = request.get_json()
     plaintext = data.get('plaintext', '')
     password = data.get('password', '')
     profile = data.get('profile', 'balanced')  # security profile: fast, balanced, high
+    wrapped = bool(data.get('wrapped'))  # key-wrapped envelope (supports re-keying)
     
     if not plaintext or not password:
         log_operation('Encrypt (AES-GCM)', 'AES-GCM', False, 'Missing plaintext or password')
@@ -110,14 +146,15 @@ def encrypt():
         return jsonify({'error': msg, 'warning': msg}), 400
     
     try:
-        ciphertext = aes_gcm.encrypt(plaintext.encode(), password, profile)
-        log_operation('Encrypt (AES-GCM)', 'AES-GCM', True, details={'profile': profile, 'size': len(plaintext)})
+        encrypt_fn = aes_gcm.encrypt_wrapped if wrapped else aes_gcm.encrypt
+        ciphertext = encrypt_fn(plaintext.encode(), password, profile)
+        log_operation('Encrypt (AES-GCM)', 'AES-GCM', True, details={'profile': profile, 'size': len(plaintext), 'wrapped': wrapped})
         return jsonify({'ciphertext': ciphertext})
     except Exception as e:
         log_operation('Encrypt (AES-GCM)', 'AES-GCM', False, str(e))
         return jsonify({'error': f'AES encryption failed: {e}'}), 500
 
-@app.route('/api/decrypt', methods=['POST'])
+@api.route('/api/decrypt', methods=['POST'])
 def decrypt():
     data = request.get_json()
     ciphertext = data.get('ciphertext', '')
@@ -126,7 +163,7 @@ def decrypt():
         log_operation('Decrypt (AES-GCM)', 'AES-GCM', False, 'Missing ciphertext or password')
         return jsonify({'error': 'Missing ciphertext or password'}), 400
     try:
-        plaintext = aes_gcm.decrypt(ciphertext, password)
+        plaintext = aes_gcm.decrypt(ciphertext, password, key_cache=get_key_cache())
         log_operation('Decrypt (AES-GCM)', 'AES-GCM', True, details={'size': len(plaintext)})
         return jsonify({'plaintext': plaintext.decode(errors='replace')})
     except ValueError as e:
@@ -137,7 +174,54 @@ def decrypt():
         log_operation('Decrypt (AES-GCM)', 'AES-GCM', False, str(e))
         return jsonify({'error': f'AES decryption failed: {e}'}), 500
 
-@app.route('/api/encrypt_file', methods=['POST'])
+@api.route('/api/inspect_envelope', methods=['POST'])
+def inspect_envelope():
+    """Return envelope metadata (profile, iterations, size, fingerprint) without a password."""
+    data = request.get_json()
+    ciphertext = data.get('ciphertext', '')
+    if not ciphertext:
+        return jsonify({'error': 'Missing ciphertext'}), 400
+    try:
+        return jsonify(aes_gcm.inspect(ciphertext))
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid envelope: {e}'}), 400
+
+@api.route('/api/rekey', methods=['POST'])
+def rekey():
+    """Re-wrap envelopes under a new password/profile without re-encrypting payloads."""
+    data = request.get_json()
+    ciphertexts = data.get('ciphertexts')
+    old_password = data.get('old_password', '')
+    new_password = data.get('new_password', '')
+    profile = data.get('profile')
+    if not isinstance(ciphertexts, list) or not ciphertexts or not old_password or not new_password:
+        log_operation('Re-key (AES-GCM)', 'AES-GCM', False, 'Missing ciphertexts or passwords')
+        return jsonify({'error': 'Missing ciphertexts, old_password or new_password'}), 400
+    if len(ciphertexts) > MAX_REKEY_ENVELOPES:
+        return jsonify({'error': f'At most {MAX_REKEY_ENVELOPES} envelopes per request'}), 400
+    if not all(isinstance(c, str) for c in ciphertexts):
+        return jsonify({'error': 'Ciphertexts must be strings'}), 400
+
+    is_valid, msg = validate_password_strength(new_password)
+    if not is_valid:
+        log_operation('Re-key (AES-GCM)', 'AES-GCM', False, msg)
+        return jsonify({'error': msg, 'warning': msg}), 400
+
+    result = aes_gcm.rekey_many(ciphertexts, old_password, new_password, profile)
+    log_operation('Re-key (AES-GCM)', 'AES-GCM', not result['errors'], details={
+        'count': len(ciphertexts),
+        'rewrapped': result['rewrapped'],
+        'migrated': result['migrated'],
+        'failed': len(result['errors']),
+    })
+    return jsonify({
+        'ciphertexts': result['envelopes'],
+        'rewrapped': result['rewrapped'],
+        'migrated': result['migrated'],
+        'errors': [{'index': index, 'error': error} for index, error in result['errors']],
+    })
+
+@api.route('/api/encrypt_file', methods=['POST'])
 def encrypt_file():
     data = request.get_json()
     filedata_b64 = data.get('filedata_b64')
@@ -151,7 +235,7 @@ def encrypt_file():
     except Exception as e:
         return jsonify({'error': f'File encryption failed: {e}'}), 500
 
-@app.route('/api/decrypt_file', methods=['POST'])
+@api.route('/api/decrypt_file', methods=['POST'])
 def decrypt_file():
     data = request.get_json()
     ciphertext = data.get('ciphertext')
@@ -168,7 +252,7 @@ def decrypt_file():
 
 
 # --- NEW: Password Strength Validation ---
-@app.route('/api/check_password_strength', methods=['POST'])
+@api.route('/api/check_password_strength', methods=['POST'])
 def check_password_strength():
     """Validate password against security criteria."""
     data = request.get_json()
@@ -176,47 +260,49 @@ def check_password_strength():
     if not password:
         return jsonify({'strength': 0, 'feedback': 'Password required'}), 400
     
-    score = 0
-    feedback = []
-    
-    if len(password) >= 12:
-        score += 30
-    elif len(password) >= 8:
-        score += 15
-    else:
-        feedback.append('Use at least 8 characters (12+ recommended)')
-    
-    if re.search(r'[a-z]', password):
-        score += 10
-    else:
-        feedback.append('Add lowercase letters')
-    
-    if re.search(r'[A-Z]', password):
-        score += 10
-    else:
-        feedback.append('Add uppercase letters')
-    
-    if re.search(r'[0-9]', password):
-        score += 15
-    else:
-        feedback.append('Add numbers')
-    
-    if re.search(r'[!@#$%^&*()_+\-=\[\]{};:\'",.<>?/\\|`~]', password):
-        score += 25
-    else:
-        feedback.append('Add special characters')
-    
-    strength_label = 'Weak' if score < 30 else 'Fair' if score < 60 else 'Good' if score < 80 else 'Strong'
-    
+    result = password_strength.score_password(password, get_breach_list())
+    return jsonify({
+        'strength': result.score,
+        'label': result.label,
+        'feedback': result.feedback
+    })
+
+
+@api.route('/api/check_password_strength_bulk', methods=['POST'])
+def check_password_strength_bulk():
+    """Score many passwords at once for account-hygiene audits.
+
+    Returns parallel arrays: scores (0-100), label indices into label_names
+    and feedback bitmasks described by feedback_codes. With "packed": true
+    each array is returned as base64 of its uint8 bytes.
+    """
+    data = request.get_json()
+    passwords = data.get('passwords')
+    if not isinstance(passwords, list) or not passwords:
+        return jsonify({'error': 'Missing passwords list'}), 400
+    if len(passwords) > MAX_BULK_PASSWORDS:
+        return jsonify({'error': f'At most {MAX_BULK_PASSWORDS} passwords per request'}), 400
+    if not all(isinstance(p, str) for p in passwords):
+        return jsonify({'error': 'Passwords must be strings'}), 400
+
+    result = password_strength.score_passwords(passwords, get_breach_list())
+    packed = bool(data.get('packed'))
+
+    def encode(values):
+        return base64.b64encode(values.tobytes()).decode() if packed else values.tolist()
+
     return jsonify({
-        'strength': min(100, score),
-        'label': strength_label,
-        'feedback': feedback
+        'count': len(passwords),
+        'scores': encode(result.scores),
+        'labels': encode(result.labels),
+        'feedback': encode(result.feedback),
+        'label_names': password_strength.LABELS,
+        'feedback_codes': {flag: message for flag, message in password_strength.FEEDBACK_MESSAGES},
     })
 
 
 # --- NEW: File Integrity Check (SHA-256) ---
-@app.route('/api/verify_file_hash', methods=['POST'])
+@api.route('/api/verify_file_hash', methods=['POST'])
 def verify_file_hash():
     """Verify file integrity using SHA-256 hash."""
     data = request.get_json()
@@ -241,7 +327,7 @@ def verify_file_hash():
 
 
 # --- NEW: Compression before Encryption ---
-@app.route('/api/compress_data', methods=['POST'])
+@api.route('/api/compress_data', methods=['POST'])
 def compress_data():
     """Compress data using gzip before encryption."""
     data = request.get_json()
@@ -250,6 +336,8 @@ def compress_data():
     if not plaintext:
         return jsonify({'error': 'Missing plaintext'}), 400
     
+    import gzip
+
     try:
         plaintext_bytes = plaintext.encode() if isinstance(plaintext, str) else plaintext
         compressed = gzip.compress(plaintext_bytes, compresslevel=9)
@@ -267,7 +355,7 @@ def compress_data():
 
 
 # --- NEW: Decompress Data ---
-@app.route('/api/decompress_data', methods=['POST'])
+@api.route('/api/decompress_data', methods=['POST'])
 def decompress_data():
     """Decompress gzip-compressed data."""
     data = request.get_json()
@@ -276,6 +364,8 @@ def decompress_data():
     if not compressed_b64:
         return jsonify({'error': 'Missing compressed data'}), 400
     
+    import gzip
+
     try:
         compressed = base64.b64decode(compressed_b64)
         decompressed = gzip.decompress(compressed)
@@ -289,7 +379,7 @@ def decompress_data():
 
 
 # --- NEW: RSA Digital Signature ---
-@app.route('/api/rsa_sign', methods=['POST'])
+@api.route('/api/rsa_sign', methods=['POST'])
 def rsa_sign():
     """Sign data with RSA private key."""
     data = request.get_json()
@@ -307,7 +397,7 @@ def rsa_sign():
 
 
 # --- NEW: RSA Signature Verification ---
-@app.route('/api/rsa_verify', methods=['POST'])
+@api.route('/api/rsa_verify', methods=['POST'])
 def rsa_verify():
     """Verify RSA signature with public key."""
     data = request.get_json()
@@ -329,7 +419,7 @@ def rsa_verify():
 
 
 # --- NEW: Encryption with Metadata ---
-@app.route('/api/encrypt_with_metadata', methods=['POST'])
+@api.route('/api/encrypt_with_metadata', methods=['POST'])
 def encrypt_with_metadata():
     """Encrypt data with timestamp and description metadata."""
     data = request.get_json()
@@ -366,7 +456,7 @@ def encrypt_with_metadata():
 
 
 # --- NEW: Decrypt with Metadata Extraction ---
-@app.route('/api/decrypt_with_metadata', methods=['POST'])
+@api.route('/api/decrypt_with_metadata', methods=['POST'])
 def decrypt_with_metadata():
     """Decrypt data and extract metadata."""
     data = request.get_json()
@@ -394,32 +484,102 @@ def decrypt_with_metadata():
 
 
 # Serve frontend at root
-@app.route('/')
+@api.route('/')
 def serve_index():
     return send_from_directory(FRONTEND_DIR, 'clean_encryption_app.html')
 
 # Serve static files (css, js, etc.) if needed
-@app.route('/<path:filename>')
+@api.route('/<path:filename>')
 def serve_static(filename):
     return send_from_directory(FRONTEND_DIR, filename)
 
 # --- NEW: Audit Log Endpoint ---
-@app.route('/api/audit_log', methods=['GET'])
+@api.route('/api/audit_log', methods=['GET'])
 def get_audit_log():
     """Return session audit log (no plaintext, no passwords)."""
-    return jsonify({'log': audit_log})
+    return jsonify({'log': get_store().get_log()})
 
 # --- NEW: Session Status ---
-@app.route('/api/session_status', methods=['GET'])
+@api.route('/api/session_status', methods=['GET'])
 def session_status():
     """Return session info (operations count, last operation, etc.)."""
+    store = get_store()
+    audit_log = store.get_log()
     return jsonify({
         'operations_count': len(audit_log),
         'last_operation': audit_log[-1] if audit_log else None,
+        'metrics': store.get_counters(),
+        'kdf_calibration': current_app.config['KDF_CALIBRATION'],  # est. seconds per profile, if warmed up
         'session_start': 'Session initiated'
     })
 
+# --- Warm-up Hooks ---
+def _warm_up(app: Flask):
+    """Pre-generate RSA key pairs and calibrate the KDF off the request path."""
+    pool_size = app.config['WARMUP_KEY_POOL']
+    if pool_size:
+        rsa_utils.fill_key_pool(pool_size)
+    if app.config['WARMUP_KDF']:
+        # Calibrate once per deployment, not once per worker
+        store = app.extensions['state']
+        calibration = store.cache_get('kdf_calibration')
+        if calibration is None:
+            calibration = aes_gcm.calibrate_kdf()
+            store.cache_set('kdf_calibration', calibration)
+        app.config['KDF_CALIBRATION'] = calibration
+
+
+def start_warm_up(app: Flask) -> threading.Thread | None:
+    """Run optional warm-up hooks in a background thread."""
+    if not (app.config['WARMUP_KEY_POOL'] or app.config['WARMUP_KDF']):
+        return None
+    thread = threading.Thread(target=_warm_up, args=(app,), name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+# --- App Factory ---
+def create_app(config: dict = None) -> Flask:
+    """Create and configure the Flask application.
+
+    Settings (environment or `config` overrides):
+        STATE_BACKEND: State store URL for the audit log, metrics and caches
+            (memory://, sqlite:///path/state.db, redis://host:port/db)
+        BREACH_LIST_PATH: Sorted SHA-1 digest file for breached-password
+            lookups (see password_strength.BreachList.build)
+        DERIVED_KEY_CACHE_TTL: Seconds to cache PBKDF2-derived keys for
+            repeated decryption (default 0, disabled)
+        SECRET_KEY: Keys derived-key cache ids; set it so workers share cache hits
+        WARMUP_KEY_POOL: Number of RSA key pairs to pre-generate (default 0)
+        WARMUP_KDF: Time one PBKDF2 derivation to load the crypto backend
+            and record per-profile estimates in KDF_CALIBRATION (default off)
+    """
+    app = Flask(__name__)
+    CORS(app)
+
+    # Production configuration
+    app.config['DEBUG'] = os.environ.get('FLASK_ENV') != 'production'
+    app.config['WARMUP_KEY_POOL'] = int(os.environ.get('WARMUP_KEY_POOL', 0))
+    app.config['WARMUP_KDF'] = os.environ.get('WARMUP_KDF', '').lower() in ('1', 'true', 'yes')
+    app.config['KDF_CALIBRATION'] = None
+    app.config['STATE_BACKEND'] = os.environ.get('STATE_BACKEND', 'memory://')
+    app.config['BREACH_LIST_PATH'] = os.environ.get('BREACH_LIST_PATH', '')
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['DERIVED_KEY_CACHE_TTL'] = float(os.environ.get('DERIVED_KEY_CACHE_TTL', 0))
+    if config:
+        app.config.update(config)
+
+    app.extensions['state'] = state.create_store(app.config['STATE_BACKEND'])
+    # Open at startup so a bad BREACH_LIST_PATH fails here, not on every request
+    breach_list_path = app.config['BREACH_LIST_PATH']
+    app.extensions['breach_list'] = password_strength.BreachList(breach_list_path) if breach_list_path else None
+    app.register_blueprint(api)
+    app.extensions['warm_up'] = start_warm_up(app)
+    return app
+
+
+app = create_app()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=app.config['DEBUG'])
-
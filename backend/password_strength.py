@@ -0,0 +1,185 @@
+"""Password strength scoring for single passwords and bulk audits.
+
+Each password is classified in one pass: str.translate maps every ASCII
+character to a class marker, and the set of markers plus a length bucket
+indexes a precomputed (score, label, feedback) table.
+
+Bulk results are compact arrays (array('B')):
+    scores: 0-100
+    labels: index into LABELS
+    feedback: bitmask of FEEDBACK_* flags (decode with feedback_messages())
+
+Breach lists are files of sorted, fixed-width SHA-1 digests. They are
+memory-mapped and binary-searched, so lookups cost O(log n) page reads and
+the list is never loaded into RAM.
+"""
+import hashlib
+import mmap
+import string
+from array import array
+from collections import namedtuple
+
+SPECIAL_CHARACTERS = '!@#$%^&*()_+-=[]{};:\'",.<>?/\\|`~'
+
+LABELS = ('Weak', 'Fair', 'Good', 'Strong')
+
+FEEDBACK_LENGTH = 1
+FEEDBACK_LOWERCASE = 2
+FEEDBACK_UPPERCASE = 4
+FEEDBACK_DIGITS = 8
+FEEDBACK_SPECIAL = 16
+FEEDBACK_BREACHED = 32
+
+FEEDBACK_MESSAGES = (
+    (FEEDBACK_LENGTH, 'Use at least 8 characters (12+ recommended)'),
+    (FEEDBACK_LOWERCASE, 'Add lowercase letters'),
+    (FEEDBACK_UPPERCASE, 'Add uppercase letters'),
+    (FEEDBACK_DIGITS, 'Add numbers'),
+    (FEEDBACK_SPECIAL, 'Add special characters'),
+    (FEEDBACK_BREACHED, 'Password appears in a known breach list'),
+)
+
+# Character class markers; control characters never reach the markers
+_LOWER, _UPPER, _DIGIT, _SPECIAL = '\x01', '\x02', '\x04', '\x08'
+_CLASS_TABLE = str.maketrans({chr(c): '' for c in range(128)})
+_CLASS_TABLE.update(str.maketrans(
+    string.ascii_lowercase + string.ascii_uppercase + string.digits + SPECIAL_CHARACTERS,
+    _LOWER * 26 + _UPPER * 26 + _DIGIT * 10 + _SPECIAL * len(SPECIAL_CHARACTERS),
+))
+_CLASS_BITS = {_LOWER: 1, _UPPER: 2, _DIGIT: 4, _SPECIAL: 8}
+_CLASS_SCORES = ((1, 10, FEEDBACK_LOWERCASE), (2, 10, FEEDBACK_UPPERCASE),
+                 (4, 15, FEEDBACK_DIGITS), (8, 25, FEEDBACK_SPECIAL))
+
+
+def _label_index(score: int) -> int:
+    return 0 if score < 30 else 1 if score < 60 else 2 if score < 80 else 3
+
+
+def _build_score_table():
+    # Index: length_bucket * 16 + class_mask -> (score, label_index, feedback)
+    table = []
+    for length_score, length_feedback in ((0, FEEDBACK_LENGTH), (15, 0), (30, 0)):
+        for mask in range(16):
+            score, feedback = length_score, length_feedback
+            for bit, points, missing in _CLASS_SCORES:
+                if mask & bit:
+                    score += points
+                else:
+                    feedback |= missing
+            score = min(100, score)
+            table.append((score, _label_index(score), feedback))
+    return tuple(table)
+
+
+_SCORE_TABLE = _build_score_table()
+_BREACHED_RESULT = (0, 0)  # score, label_index
+
+Strength = namedtuple('Strength', 'score label feedback')
+BulkStrength = namedtuple('BulkStrength', 'scores labels feedback')
+
+
+def _classify(password: str):
+    length = len(password)
+    bucket = 2 if length >= 12 else 1 if length >= 8 else 0
+    mask = 0
+    for marker in set(password.translate(_CLASS_TABLE)):
+        mask |= _CLASS_BITS.get(marker, 0)
+    return _SCORE_TABLE[bucket * 16 + mask]
+
+
+def feedback_messages(code: int) -> list:
+    """Decode a feedback bitmask into messages."""
+    return [message for flag, message in FEEDBACK_MESSAGES if code & flag]
+
+
+def score_password(password: str, breach_list=None) -> Strength:
+    """Score a single password.
+
+    Returns:
+        Strength(score, label, feedback) with feedback as a list of messages
+    """
+    score, label, feedback = _classify(password)
+    if breach_list is not None and password in breach_list:
+        score, label = _BREACHED_RESULT
+        feedback |= FEEDBACK_BREACHED
+    return Strength(score, LABELS[label], feedback_messages(feedback))
+
+
+def score_passwords(passwords, breach_list=None) -> BulkStrength:
+    """Score many passwords.
+
+    Args:
+        passwords: Iterable of password strings
+        breach_list: Optional BreachList; matches score 0 with FEEDBACK_BREACHED
+
+    Returns:
+        BulkStrength of three array('B') with one entry per password
+    """
+    scores, labels, feedback = array('B'), array('B'), array('B')
+    classify = _classify
+    for password in passwords:
+        score, label, code = classify(password)
+        if breach_list is not None and password in breach_list:
+            score, label = _BREACHED_RESULT
+            code |= FEEDBACK_BREACHED
+        scores.append(score)
+        labels.append(label)
+        feedback.append(code)
+    return BulkStrength(scores, labels, feedback)
+
+
+def _encode(password: str) -> bytes:
+    # JSON allows lone surrogates ("\ud800"); hash them instead of failing
+    return password.encode('utf-8', 'surrogatepass')
+
+
+class BreachList:
+    """Membership test against a memory-mapped file of sorted SHA-1 digests."""
+
+    DIGEST_SIZE = 20
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            if size % self.DIGEST_SIZE:
+                raise ValueError(f'Breach list size is not a multiple of {self.DIGEST_SIZE} bytes: {path}')
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._count = size // self.DIGEST_SIZE
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, password: str) -> bool:
+        return self.contains_digest(hashlib.sha1(_encode(password)).digest())
+
+    def contains_digest(self, digest: bytes) -> bool:
+        """Binary search for a raw SHA-1 digest."""
+        size, data = self.DIGEST_SIZE, self._map
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = data[mid * size:(mid + 1) * size]
+            if entry < digest:
+                lo = mid + 1
+            elif entry > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    @staticmethod
+    def build(passwords, path: str) -> int:
+        """Write a breach list file from an iterable of passwords.
+
+        Returns:
+            Number of unique entries written
+        """
+        digests = sorted({hashlib.sha1(_encode(p)).digest() for p in passwords})
+        with open(path, 'wb') as f:
+            f.write(b''.join(digests))
+        return len(digests)
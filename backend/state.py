@@ -0,0 +1,483 @@
+"""Pluggable state store for the audit log, metrics counters and caches.
+
+Backends are selected by URL (STATE_BACKEND):
+    memory://                 In-process (default, one view per worker)
+    sqlite:///path/state.db   SQLite in WAL mode, shared by workers on one host
+    redis://[[user]:password@]host:port/db
+                              Any server speaking the Redis protocol (RESP)
+
+Audit log entries and counter increments are buffered per process and written
+in batches by a daemon flusher thread, every FLUSH_INTERVAL seconds or as soon
+as BATCH_SIZE writes are queued, so request handlers only take a short
+in-memory lock. Reads flush the local buffer first, so a worker always sees
+its own writes.
+"""
+import abc
+import atexit
+import base64
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+LOG_LIMIT = 100  # Keep only last 100 audit entries
+BATCH_SIZE = 20
+FLUSH_INTERVAL = 1.0  # seconds
+MEMORY_CACHE_LIMIT = 1024  # entries; oldest are evicted first
+_PROCESS_SECRET = os.urandom(32)  # default DerivedKeyCache secret
+
+
+class StateServerError(RuntimeError):
+    """Error reply from a Redis-protocol state server."""
+
+
+class PartialWriteError(StateServerError):
+    """A batch was only partly applied; carries what still needs writing."""
+
+    def __init__(self, message: str, entries: list, counters: dict):
+        super().__init__(message)
+        self.entries = entries
+        self.counters = counters
+
+
+class StateStore(abc.ABC):
+    """Base store: buffers writes and delegates storage to subclasses."""
+
+    background_flush = True  # flush from a daemon thread instead of the request thread
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 log_limit: int = LOG_LIMIT):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.log_limit = log_limit
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending_log = []
+        self._pending_counters = {}
+        self._pending_count = 0
+        self._wake = threading.Event()
+        self._flusher = None
+        self._flusher_pid = None
+
+    # --- Buffered writes ---
+    def append_log(self, entry: dict):
+        """Queue an audit log entry."""
+        with self._lock:
+            self._pending_log.append(entry)
+            self._pending_count += 1
+        self._schedule_flush()
+
+    def incr(self, name: str, amount: int = 1):
+        """Queue a counter increment."""
+        with self._lock:
+            self._pending_counters[name] = self._pending_counters.get(name, 0) + amount
+            self._pending_count += 1
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self.background_flush:
+            self.flush()
+            return
+        self._ensure_flusher()
+        if self._pending_count >= self.batch_size:
+            self._wake.set()
+
+    def _ensure_flusher(self):
+        # Threads do not survive fork, so each worker starts its own flusher
+        if self._flusher is not None and self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher_pid == os.getpid():
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name='state-flusher', daemon=True)
+            self._flusher_pid = os.getpid()
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Entries stay queued; retry on the next interval
+                pass
+
+    def flush(self):
+        """Write buffered log entries and counters to the backend."""
+        with self._flush_lock:
+            with self._lock:
+                entries, counters = self._pending_log, self._pending_counters
+                self._pending_log, self._pending_counters = [], {}
+                self._pending_count = 0
+            if not (entries or counters):
+                return
+            try:
+                self._write_batch(entries, counters)
+            except PartialWriteError as e:
+                # Re-queue only what the backend did not apply
+                self._requeue(e.entries, e.counters)
+                raise
+            except Exception:
+                self._requeue(entries, counters)
+                raise
+
+    def _requeue(self, entries: list, counters: dict):
+        with self._lock:
+            self._pending_log[:0] = entries
+            for name, amount in counters.items():
+                self._pending_counters[name] = self._pending_counters.get(name, 0) + amount
+            self._pending_count += len(entries) + len(counters)
+
+    # --- Reads ---
+    def get_log(self) -> list:
+        """Return the audit log, oldest entry first."""
+        self.flush()
+        return self._read_log()
+
+    def get_counters(self) -> dict:
+        """Return all metrics counters."""
+        self.flush()
+        return self._read_counters()
+
+    # --- Cache (written through, values must be JSON-serializable) ---
+    @abc.abstractmethod
+    def cache_get(self, key: str):
+        """Return a cached value, or None if missing or expired."""
+
+    @abc.abstractmethod
+    def cache_set(self, key: str, value, ttl: float = None):
+        """Cache a value, expiring after ttl seconds when given."""
+
+    # --- Backend hooks ---
+    @abc.abstractmethod
+    def _write_batch(self, entries: list, counters: dict):
+        """Append log entries (trimmed to log_limit) and apply counter increments."""
+
+    @abc.abstractmethod
+    def _read_log(self) -> list:
+        """Return stored log entries, oldest first."""
+
+    @abc.abstractmethod
+    def _read_counters(self) -> dict:
+        """Return stored counters."""
+
+
+class MemoryStore(StateStore):
+    """Per-process store. Writes are applied immediately."""
+
+    background_flush = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._log = []
+        self._counters = {}
+        self._cache = {}
+        self._cache_lock = threading.Lock()  # request threads and warm-up share the cache
+
+    def _write_batch(self, entries, counters):
+        self._log.extend(entries)
+        del self._log[:-self.log_limit]
+        for name, amount in counters.items():
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def _read_log(self):
+        return list(self._log)
+
+    def _read_counters(self):
+        return dict(self._counters)
+
+    def cache_get(self, key):
+        with self._cache_lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._cache[key]
+                return None
+            return value
+
+    def cache_set(self, key, value, ttl=None):
+        now = time.time()
+        with self._cache_lock:
+            expired = [k for k, (_, expires) in self._cache.items() if expires is not None and expires < now]
+            for k in expired:
+                del self._cache[k]
+            self._cache.pop(key, None)
+            self._cache[key] = (value, now + ttl if ttl else None)
+            while len(self._cache) > MEMORY_CACHE_LIMIT:
+                del self._cache[next(iter(self._cache))]
+
+
+class SQLiteStore(StateStore):
+    """Host-local store shared by all workers through one SQLite file (WAL mode)."""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS audit_log (id INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)',
+        'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    )
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write_batch(self, entries, counters):
+        conn = self._conn()
+        with conn:
+            if entries:
+                conn.executemany('INSERT INTO audit_log (entry) VALUES (?)',
+                                 [(json.dumps(e),) for e in entries])
+                conn.execute('DELETE FROM audit_log WHERE id <= (SELECT MAX(id) FROM audit_log) - ?',
+                             (self.log_limit,))
+            if counters:
+                conn.executemany(
+                    'INSERT INTO counters (name, value) VALUES (?, ?) '
+                    'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                    list(counters.items()),
+                )
+            self._sweep_cache(conn)
+
+    @staticmethod
+    def _sweep_cache(conn: sqlite3.Connection):
+        # Expired entries may hold derived keys; don't leave them on disk
+        conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    def _read_log(self):
+        rows = self._conn().execute('SELECT entry FROM audit_log ORDER BY id').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _read_counters(self):
+        return dict(self._conn().execute('SELECT name, value FROM counters').fetchall())
+
+    def cache_get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            with conn:
+                conn.execute('DELETE FROM cache WHERE key = ? AND expires < ?', (key, time.time()))
+            return None
+        return json.loads(row[0])
+
+    def cache_set(self, key, value, ttl=None):
+        conn = self._conn()
+        with conn:
+            self._sweep_cache(conn)
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                         (key, json.dumps(value), time.time() + ttl if ttl else None))
+
+
+class RedisStore(StateStore):
+    """Store backed by a Redis-protocol server (Redis, Valkey, KeyDB or a local stand-in).
+
+    Speaks RESP directly over a socket; batches are sent as one pipeline.
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0,
+                 prefix: str = 'encrypted:', timeout: float = 5.0,
+                 username: str = None, password: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.host, self.port, self.db = host, port, db
+        self.username, self.password = username, password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._pid = None
+        self._io_lock = threading.Lock()
+
+    # --- RESP protocol ---
+    def _connect(self):
+        if self._sock is not None and self._pid == os.getpid():
+            return
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile('rb')
+        self._pid = os.getpid()
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.username, self.password) if self.username else ('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._send(setup)
+            self._raise_first_error([self._read_reply() for _ in setup])
+
+    def _disconnect(self):
+        for handle in (self._file, self._sock):
+            if handle is not None:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+        self._sock = self._file = None
+
+    def _send(self, commands):
+        buf = bytearray()
+        for command in commands:
+            buf += b'*%d\r\n' % len(command)
+            for arg in command:
+                arg = arg if isinstance(arg, bytes) else str(arg).encode()
+                buf += b'$%d\r\n%s\r\n' % (len(arg), arg)
+        self._sock.sendall(buf)
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('State server closed the connection')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            # Returned, not raised, so the rest of the pipeline is still read
+            return StateServerError(f'State server error: {rest.decode()}')
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._file.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f'Unexpected reply from state server: {line!r}')
+
+    @staticmethod
+    def _raise_first_error(replies):
+        for reply in replies:
+            if isinstance(reply, StateServerError):
+                raise reply
+
+    def execute(self, *commands, raise_errors: bool = True):
+        """Send commands as one pipeline and return their replies.
+
+        Every reply is read before an error is raised, so the connection stays
+        in sync. With raise_errors=False, error replies are returned as
+        StateServerError instances.
+        """
+        with self._io_lock:
+            try:
+                self._connect()
+                self._send(commands)
+                replies = [self._read_reply() for _ in commands]
+            except Exception:
+                # Connection state is unknown; never reuse it
+                self._disconnect()
+                raise
+        if raise_errors:
+            self._raise_first_error(replies)
+        return replies
+
+    # --- Storage ---
+    def _key(self, name: str) -> str:
+        return self.prefix + name
+
+    def _write_batch(self, entries, counters):
+        # MULTI/EXEC: nothing is applied unless EXEC runs. Commands that fail
+        # inside EXEC are not rolled back, so only those are reported back.
+        commands = []
+        if entries:
+            commands.append(('RPUSH', self._key('audit_log'), *(json.dumps(e) for e in entries)))
+            commands.append(('LTRIM', self._key('audit_log'), -self.log_limit, -1))
+        names = list(counters)
+        for name in names:
+            commands.append(('HINCRBY', self._key('counters'), name, counters[name]))
+        replies = self.execute(('MULTI',), *commands, ('EXEC',), raise_errors=False)
+        # Queueing errors or EXECABORT mean the transaction was discarded
+        self._raise_first_error(replies[:-1])
+        results = replies[-1]
+        if not isinstance(results, list):
+            raise results if isinstance(results, StateServerError) else StateServerError('Transaction aborted')
+        failed_entries = entries if entries and isinstance(results[0], StateServerError) else []
+        counter_results = results[2:] if entries else results
+        failed_counters = {name: counters[name] for name, result in zip(names, counter_results)
+                           if isinstance(result, StateServerError)}
+        if failed_entries or failed_counters:
+            raise PartialWriteError('State batch partly applied', failed_entries, failed_counters)
+
+    def _read_log(self):
+        items = self.execute(('LRANGE', self._key('audit_log'), 0, -1))[0]
+        return [json.loads(item) for item in items]
+
+    def _read_counters(self):
+        flat = self.execute(('HGETALL', self._key('counters')))[0]
+        return {flat[i].decode(): int(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+    def cache_get(self, key):
+        value = self.execute(('GET', self._key('cache:' + key)))[0]
+        return None if value is None else json.loads(value)
+
+    def cache_set(self, key, value, ttl=None):
+        command = ('SET', self._key('cache:' + key), json.dumps(value))
+        if ttl:
+            command += ('PX', int(ttl * 1000))
+        self.execute(command)
+
+
+def create_store(url: str = None, **kwargs) -> StateStore:
+    """Create a state store from a backend URL (see module docstring)."""
+    url = url or 'memory://'
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryStore(**kwargs)
+    if parsed.scheme == 'sqlite':
+        store = SQLiteStore(parsed.netloc + parsed.path, **kwargs)
+    elif parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        store = RedisStore(parsed.hostname or 'localhost', parsed.port or 6379, db,
+                           username=unquote(parsed.username) if parsed.username else None,
+                           password=unquote(parsed.password) if parsed.password else None,
+                           **kwargs)
+    else:
+        raise ValueError(f'Unsupported state backend: {url}')
+    # Don't lose buffered entries when a worker shuts down
+    atexit.register(store.flush)
+    return store
+
+
+class DerivedKeyCache:
+    """Cache of PBKDF2-derived keys in a state store, keyed by envelope identity.
+
+    Lets repeated decryption of the same envelope skip the KDF on every worker.
+    Derived keys are secret: only enable this with a store that is as trusted
+    as the process itself.
+    """
+
+    def __init__(self, store: StateStore, ttl: float, secret: bytes = None):
+        self.store = store
+        self.ttl = ttl
+        # Keys the cache ids; never written to the store. Workers share hits
+        # only if they share the secret (set SECRET_KEY, or fork after import).
+        self.secret = secret or _PROCESS_SECRET
+
+    def get(self, cache_id: str):
+        value = self.store.cache_get('derived_key:' + cache_id)
+        return base64.b64decode(value) if value else None
+
+    def set(self, cache_id: str, key: bytes):
+        self.store.cache_set('derived_key:' + cache_id, base64.b64encode(key).decode(), self.ttl)
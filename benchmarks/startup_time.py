@@ -0,0 +1,75 @@
+"""Measure backend cold-start cost.
+
+Each run starts a fresh interpreter and records:
+    import_s: time to import backend.app (Flask app created)
+    first_response_s: time to answer GET /api/session_status
+    first_crypto_s: time to answer the first POST /api/encrypt (loads crypto modules)
+    crypto_loaded_at_import: whether crypto modules were imported eagerly
+
+Usage:
+    python benchmarks/startup_time.py [--runs N] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+from backend.app import app
+imported = time.perf_counter()
+crypto_loaded = 'crypto.aes_gcm' in sys.modules
+client = app.test_client()
+client.get('/api/session_status')
+responded = time.perf_counter()
+client.post('/api/encrypt', json={'plaintext': 'x', 'password': 'benchmark-pass', 'profile': 'fast'})
+encrypted = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'first_response_s': responded - start,
+    'first_crypto_s': encrypted - responded,
+    'crypto_loaded_at_import': crypto_loaded,
+}))
+'''
+
+
+def run_once() -> dict:
+    env = dict(os.environ, WARMUP_KEY_POOL='0', WARMUP_KDF='0')
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='Print raw results as JSON')
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    summary = {
+        key: statistics.median(r[key] for r in results)
+        for key in ('import_s', 'first_response_s', 'first_crypto_s')
+    }
+    summary['crypto_loaded_at_import'] = any(r['crypto_loaded_at_import'] for r in results)
+    summary['runs'] = args.runs
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"runs:                 {args.runs}")
+    print(f"import (median):      {summary['import_s'] * 1000:.1f} ms")
+    print(f"first response:       {summary['first_response_s'] * 1000:.1f} ms")
+    print(f"first encrypt:        {summary['first_crypto_s'] * 1000:.1f} ms")
+    print(f"crypto eager-loaded:  {summary['crypto_loaded_at_import']}")
+
+
+if __name__ == '__main__':
+    main()
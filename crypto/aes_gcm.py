@@ -3,21 +3,27 @@ import base64
 import json
 import hmac
 import hashlib
+import time
 from typing import Tuple, Dict
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
 
 # Versioning and security profiles
 VERSION = '1.0'
+WRAPPED_VERSION = '2.0'  # key-wrapped envelope, see encrypt_wrapped()
+WRAPPED_SEPARATOR = '.'  # never appears in base64
 PBKDF2_ITERATIONS_FAST = 100_000
 PBKDF2_ITERATIONS_BALANCED = 200_000
 PBKDF2_ITERATIONS_HIGH = 400_000
 PBKDF2_ITERATIONS = PBKDF2_ITERATIONS_BALANCED  # default
+PROFILE_ITERATIONS = {'fast': PBKDF2_ITERATIONS_FAST, 'balanced': PBKDF2_ITERATIONS_BALANCED, 'high': PBKDF2_ITERATIONS_HIGH}
 
 SALT_SIZE = 16  # bytes
 NONCE_SIZE = 12  # bytes
 KEY_SIZE = 32  # 256 bits
+TAG_SIZE = 16  # bytes, AES-GCM authentication tag
 
 
 def derive_key(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
@@ -31,12 +37,36 @@ def derive_key(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS)
     return kdf.derive(password.encode())
 
 
+def calibrate_kdf(iterations: int = PBKDF2_ITERATIONS_FAST) -> Dict[str, float]:
+    """Time one PBKDF2 derivation and estimate per-profile cost.
+
+    Also loads the OpenSSL backend so the first real request does not pay for it.
+
+    Returns:
+        Mapping of profile name to estimated derivation time in seconds
+    """
+    start = time.perf_counter()
+    derive_key('calibration', os.urandom(SALT_SIZE), iterations)
+    per_iteration = (time.perf_counter() - start) / iterations
+    return {profile: per_iteration * count for profile, count in PROFILE_ITERATIONS.items()}
+
+
 def compute_password_hmac(password: str, salt: bytes) -> str:
     """Compute HMAC-SHA256 of password for verification without storing plaintext."""
     hmac_obj = hmac.new(salt, password.encode(), hashlib.sha256)
     return base64.b64encode(hmac_obj.digest()).decode()
 
 
+def derived_key_cache_id(secret: bytes, salt: bytes, iterations: int, password: str) -> str:
+    """Identify a derived key by salt, iterations and password.
+    
+    Keyed with a secret that never leaves the process, so cache keys cannot be
+    used to brute-force the password without the PBKDF2 cost.
+    """
+    material = salt + iterations.to_bytes(8, 'big') + password.encode('utf-8', 'surrogatepass')
+    return hmac.new(secret, material, hashlib.sha256).hexdigest()
+
+
 def encrypt(plaintext: bytes, password: str, profile: str = 'balanced') -> str:
     """Encrypt plaintext with AES-GCM using password-derived key.
     
@@ -52,8 +82,7 @@ def encrypt(plaintext: bytes, password: str, profile: str = 'balanced') -> str:
         raise ValueError('Password must be at least 8 characters')
     
     # Select KDF iterations based on profile
-    profile_map = {'fast': PBKDF2_ITERATIONS_FAST, 'balanced': PBKDF2_ITERATIONS_BALANCED, 'high': PBKDF2_ITERATIONS_HIGH}
-    iterations = profile_map.get(profile, PBKDF2_ITERATIONS_BALANCED)
+    iterations = PROFILE_ITERATIONS.get(profile, PBKDF2_ITERATIONS_BALANCED)
     
     salt = os.urandom(SALT_SIZE)
     nonce = os.urandom(NONCE_SIZE)
@@ -84,12 +113,15 @@ def encrypt(plaintext: bytes, password: str, profile: str = 'balanced') -> str:
     return base64.b64encode(json.dumps(out).encode()).decode()
 
 
-def decrypt(encoded: str, password: str) -> bytes:
+def decrypt(encoded: str, password: str, key_cache=None) -> bytes:
     """Decrypt AES-GCM ciphertext using password.
     
     Args:
-        encoded: Base64-encoded envelope from encrypt()
+        encoded: Base64-encoded envelope from encrypt() or encrypt_wrapped()
         password: User password
+        key_cache: Optional cache with a `secret` attribute and
+            get(cache_id)/set(cache_id, key), used to skip PBKDF2 for
+            envelopes that were already opened
     
     Returns:
         Decrypted plaintext bytes
@@ -97,19 +129,56 @@ def decrypt(encoded: str, password: str) -> bytes:
     Raises:
         ValueError: If password is wrong, ciphertext is tampered, or version incompatible
     """
-    try:
-        out = json.loads(base64.b64decode(encoded).decode())
-    except (json.JSONDecodeError, ValueError) as e:
-        raise ValueError('Invalid or corrupted ciphertext envelope') from e
+    if isinstance(encoded, str) and WRAPPED_SEPARATOR in encoded:
+        return _decrypt_wrapped(encoded, password, key_cache)
     
-    metadata = out.get('metadata', {})
+    out = _load_envelope(encoded)
+    metadata = _load_metadata(out)
     version = metadata.get('version', '1.0')
     
     if version != VERSION:
         raise ValueError(f'Unsupported ciphertext version: {version}')
     
-    salt = base64.b64decode(metadata['salt'])
-    nonce = base64.b64decode(metadata['nonce'])
+    try:
+        nonce = base64.b64decode(metadata['nonce'])
+    except (KeyError, TypeError) as e:
+        raise ValueError('Invalid or corrupted ciphertext envelope') from e
+    key = _password_key(metadata, password, key_cache)
+    
+    try:
+        aesgcm = AESGCM(key)
+        ciphertext = base64.b64decode(out['ciphertext'])
+        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
+        return plaintext
+    except Exception as e:
+        raise ValueError('Decryption failed: ciphertext may be corrupted or tampered') from e
+
+
+def _load_envelope(encoded: str) -> dict:
+    if not isinstance(encoded, str):
+        raise ValueError('Ciphertext envelope must be a string')
+    try:
+        out = json.loads(base64.b64decode(encoded).decode())
+    except (json.JSONDecodeError, ValueError) as e:
+        raise ValueError('Invalid or corrupted ciphertext envelope') from e
+    if not isinstance(out, dict):
+        raise ValueError('Invalid or corrupted ciphertext envelope')
+    return out
+
+
+def _load_metadata(out: dict) -> dict:
+    metadata = out.get('metadata', {})
+    if not isinstance(metadata, dict):
+        raise ValueError('Invalid or corrupted ciphertext envelope')
+    return metadata
+
+
+def _password_key(metadata: dict, password: str, key_cache=None) -> bytes:
+    """Verify the password against the envelope and derive its key."""
+    try:
+        salt = base64.b64decode(metadata['salt'])
+    except (KeyError, TypeError) as e:
+        raise ValueError('Invalid or corrupted ciphertext envelope') from e
     iterations = metadata.get('iterations', PBKDF2_ITERATIONS)
     stored_hmac = metadata.get('password_hmac', '')
     
@@ -118,12 +187,209 @@ def decrypt(encoded: str, password: str) -> bytes:
     if not hmac.compare_digest(computed_hmac, stored_hmac):
         raise ValueError('Wrong password or corrupted envelope')
     
+    return _derive_cached(password, salt, iterations, key_cache)
+
+
+def _derive_cached(password: str, salt: bytes, iterations: int, key_cache=None) -> bytes:
+    if key_cache is None:
+        return derive_key(password, salt, iterations)
+    cache_id = derived_key_cache_id(key_cache.secret, salt, iterations, password)
+    key = key_cache.get(cache_id)
+    if key is None:
+        key = derive_key(password, salt, iterations)
+        key_cache.set(cache_id, key)
+    return key
+
+
+# --- Key-Wrapped Envelopes ---
+# Format: <base64 JSON header>.<base64 ciphertext>
+# A random data key encrypts the payload; the password-derived key only wraps
+# the data key. Re-keying rewrites the header and never touches the payload.
+
+def _wrap_aad(header: dict) -> bytes:
+    # Binds the wrapped data key to this payload
+    return f"{header['version']}|{header['nonce']}|{header['fingerprint']}|{header['size']}".encode()
+
+
+def _wrap_data_key(header: dict, data_key: bytes, password: str, profile: str) -> dict:
+    """Fill header password fields with data_key wrapped under a new password."""
+    if len(password) < 8:
+        raise ValueError('Password must be at least 8 characters')
+    iterations = PROFILE_ITERATIONS.get(profile, PBKDF2_ITERATIONS_BALANCED)
+    salt = os.urandom(SALT_SIZE)
+    wrap_nonce = os.urandom(NONCE_SIZE)
     key = derive_key(password, salt, iterations)
+    wrapped_key = AESGCM(key).encrypt(wrap_nonce, data_key, _wrap_aad(header))
+    header.update({
+        'profile': profile,
+        'salt': base64.b64encode(salt).decode(),
+        'iterations': iterations,
+        'wrap_nonce': base64.b64encode(wrap_nonce).decode(),
+        'wrapped_key': base64.b64encode(wrapped_key).decode(),
+    })
+    return header
+
+
+def _unwrap_data_key(header: dict, password: str, key_cache=None) -> bytes:
+    # No password HMAC in v2 headers: the wrap tag rejects a wrong password,
+    # so guessing always pays the full PBKDF2 cost
+    try:
+        salt = base64.b64decode(header['salt'])
+        iterations = int(header['iterations'])
+        wrap_nonce = base64.b64decode(header['wrap_nonce'])
+        wrapped_key = base64.b64decode(header['wrapped_key'])
+        aad = _wrap_aad(header)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError('Invalid or corrupted ciphertext envelope') from e
+    key = _derive_cached(password, salt, iterations, key_cache)
+    try:
+        return AESGCM(key).decrypt(wrap_nonce, wrapped_key, aad)
+    except InvalidTag as e:
+        raise ValueError('Wrong password or corrupted envelope') from e
+
+
+def _split_wrapped(encoded: str) -> Tuple[dict, str]:
+    """Split a wrapped envelope into its parsed header and untouched payload segment."""
+    header_b64, _, payload_b64 = encoded.partition(WRAPPED_SEPARATOR)
+    header = _load_envelope(header_b64)
+    if header.get('version') != WRAPPED_VERSION:
+        raise ValueError(f"Unsupported ciphertext version: {header.get('version')}")
+    return header, payload_b64
+
+
+def _dump_header(header: dict) -> str:
+    return base64.b64encode(json.dumps(header).encode()).decode()
+
+
+def encrypt_wrapped(plaintext: bytes, password: str, profile: str = 'balanced') -> str:
+    """Encrypt plaintext under a random data key wrapped by a password-derived key.
+    
+    Args:
+        plaintext: Data to encrypt
+        password: User password (min 8 chars recommended 12+)
+        profile: Security profile ('fast', 'balanced', 'high')
     
+    Returns:
+        Key-wrapped envelope ("<header>.<ciphertext>"); open it with decrypt()
+    """
+    data_key = os.urandom(KEY_SIZE)
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(data_key).encrypt(nonce, plaintext, None)
+    
+    header = {
+        'version': WRAPPED_VERSION,
+        'alg': 'AES-GCM',
+        'kdf': 'PBKDF2-SHA256',
+        'key_wrap': 'AES-GCM',
+        'nonce': base64.b64encode(nonce).decode(),
+        'size': len(plaintext),
+        'fingerprint': base64.b64encode(hashlib.sha256(ciphertext).digest()).decode(),
+    }
+    _wrap_data_key(header, data_key, password, profile)
+    
+    return _dump_header(header) + WRAPPED_SEPARATOR + base64.b64encode(ciphertext).decode()
+
+
+def _decrypt_wrapped(encoded: str, password: str, key_cache=None) -> bytes:
+    header, payload_b64 = _split_wrapped(encoded)
+    data_key = _unwrap_data_key(header, password, key_cache)
     try:
-        aesgcm = AESGCM(key)
-        ciphertext = base64.b64decode(out['ciphertext'])
-        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-        return plaintext
+        nonce = base64.b64decode(header['nonce'])
+        return AESGCM(data_key).decrypt(nonce, base64.b64decode(payload_b64), None)
     except Exception as e:
         raise ValueError('Decryption failed: ciphertext may be corrupted or tampered') from e
+
+
+def inspect(encoded: str) -> Dict:
+    """Read envelope metadata without a password or KDF.
+    
+    Wrapped envelopes only parse the header. Legacy envelopes must be decoded
+    in full, and their fingerprint is computed from the ciphertext.
+    
+    Returns:
+        Dict with version, wrapped, alg, kdf, profile, iterations, size, fingerprint
+    """
+    if not isinstance(encoded, str):
+        raise ValueError('Ciphertext envelope must be a string')
+    if WRAPPED_SEPARATOR in encoded:
+        header, _ = _split_wrapped(encoded)
+        size, fingerprint = header['size'], header['fingerprint']
+    else:
+        out = _load_envelope(encoded)
+        header = _load_metadata(out)
+        ciphertext_b64 = out.get('ciphertext', '')
+        if not isinstance(ciphertext_b64, str):
+            raise ValueError('Invalid or corrupted ciphertext envelope')
+        ciphertext = base64.b64decode(ciphertext_b64)
+        size = max(0, len(ciphertext) - TAG_SIZE)
+        fingerprint = base64.b64encode(hashlib.sha256(ciphertext).digest()).decode()
+    return {
+        'version': header.get('version', VERSION),
+        'wrapped': header.get('version') == WRAPPED_VERSION,
+        'alg': header.get('alg'),
+        'kdf': header.get('kdf'),
+        'profile': header.get('profile'),
+        'iterations': header.get('iterations', PBKDF2_ITERATIONS),
+        'size': size,
+        'fingerprint': fingerprint,
+    }
+
+
+def rekey(encoded: str, old_password: str, new_password: str, profile: str = None, key_cache=None) -> str:
+    """Re-wrap an envelope's data key under a new password and/or profile.
+    
+    For wrapped envelopes only the header is rewritten; the payload segment is
+    reused as-is. Legacy envelopes are migrated with a one-time full
+    decrypt/encrypt_wrapped().
+    
+    The data key is unchanged, so this is not revocation: anyone who could
+    unwrap it under the old password can still read the payload. After a
+    compromise, use decrypt() + encrypt_wrapped() to get a fresh data key.
+    
+    Args:
+        encoded: Envelope from encrypt() or encrypt_wrapped()
+        old_password: Current password
+        new_password: Replacement password (may equal old_password to change profile)
+        profile: New security profile; defaults to the envelope's current profile
+        key_cache: Optional derived-key cache for the old password (see decrypt())
+    
+    Returns:
+        Key-wrapped envelope
+    """
+    if not isinstance(encoded, str):
+        raise ValueError('Ciphertext envelope must be a string')
+    if WRAPPED_SEPARATOR not in encoded:
+        metadata = _load_metadata(_load_envelope(encoded))
+        plaintext = decrypt(encoded, old_password, key_cache)
+        return encrypt_wrapped(plaintext, new_password, profile or metadata.get('profile', 'balanced'))
+    
+    header, payload_b64 = _split_wrapped(encoded)
+    data_key = _unwrap_data_key(header, old_password, key_cache)
+    _wrap_data_key(header, data_key, new_password, profile or header.get('profile', 'balanced'))
+    return _dump_header(header) + WRAPPED_SEPARATOR + payload_b64
+
+
+def rekey_many(envelopes, old_password: str, new_password: str, profile: str = None) -> Dict:
+    """Bulk re-key job over an iterable of envelopes.
+    
+    Failures are collected rather than raised so one bad envelope does not
+    stop the rotation.
+    
+    Returns:
+        Dict with 'envelopes' (re-keyed, or None where it failed), 'rewrapped'
+        and 'migrated' counts, and 'errors' as (index, message) pairs
+    """
+    results, errors = [], []
+    rewrapped = migrated = 0
+    for index, encoded in enumerate(envelopes):
+        try:
+            results.append(rekey(encoded, old_password, new_password, profile))
+        except (ValueError, KeyError, TypeError) as e:
+            results.append(None)
+            errors.append((index, str(e)))
+            continue
+        if WRAPPED_SEPARATOR in encoded:
+            rewrapped += 1
+        else:
+            migrated += 1
+    return {'envelopes': results, 'rewrapped': rewrapped, 'migrated': migrated, 'errors': errors}
@@ -2,6 +2,7 @@ from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os, base64, json, hashlib
+from collections import deque
 
 RSA_KEY_SIZE = 2048
 AES_KEY_SIZE = 32
@@ -25,6 +26,31 @@ def generate_key_pair():
     )
     return priv_pem.decode(), pub_pem.decode()
 
+
+# --- Pre-generated Key Pool (warm-up) ---
+_key_pool = deque()
+# A forked worker must never hand out the same private keys as its parent
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_key_pool.clear)
+
+
+def fill_key_pool(count: int) -> int:
+    """Pre-generate RSA key pairs so the first requests skip key generation."""
+    for _ in range(count):
+        _key_pool.append(generate_key_pair())
+    return len(_key_pool)
+
+
+def pooled_key_pair():
+    """Return a pre-generated key pair, generating one if the pool is empty.
+
+    Each pooled pair is handed out exactly once.
+    """
+    try:
+        return _key_pool.popleft()
+    except IndexError:
+        return generate_key_pair()
+
 # --- Hybrid Encrypt (RSA+AES) ---
 def hybrid_encrypt(plaintext: bytes, public_pem: str) -> str:
     public_key = serialization.load_pem_public_key(public_pem.encode())
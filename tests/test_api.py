@@ -1,6 +1,12 @@
 import unittest
+import base64
 import json
-from backend.app import app
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from backend.app import app, create_app
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
@@ -32,5 +38,92 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(resp2.status_code, 200)
         self.assertIn('plainfile', resp2.get_json())
 
+    def test_wrapped_envelope_rekey(self):
+        resp = self.client.post('/api/encrypt', json={'plaintext': 'rotate', 'password': 'apioldpass1', 'profile': 'fast', 'wrapped': True})
+        ciphertext = resp.get_json()['ciphertext']
+        info = self.client.post('/api/inspect_envelope', json={'ciphertext': ciphertext}).get_json()
+        self.assertTrue(info['wrapped'])
+        self.assertEqual(info['size'], 6)
+        resp = self.client.post('/api/rekey', json={'ciphertexts': [ciphertext], 'old_password': 'apioldpass1', 'new_password': 'apinewpass1'})
+        self.assertEqual(resp.status_code, 200)
+        rekeyed = resp.get_json()['ciphertexts'][0]
+        resp = self.client.post('/api/decrypt', json={'ciphertext': rekeyed, 'password': 'apinewpass1'})
+        self.assertEqual(resp.get_json()['plaintext'], 'rotate')
+
+    def test_malformed_envelopes_are_client_errors(self):
+        resp = self.client.post('/api/rekey', json={'ciphertexts': [123], 'old_password': 'apioldpass1', 'new_password': 'apinewpass1'})
+        self.assertEqual(resp.status_code, 400)
+        for bad in (base64.b64encode(b'[]').decode(), base64.b64encode(b'{"metadata": []}').decode(),
+                    base64.b64encode(b'{"metadata": {}, "ciphertext": 5}').decode()):
+            resp = self.client.post('/api/inspect_envelope', json={'ciphertext': bad})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_check_password_strength(self):
+        resp = self.client.post('/api/check_password_strength', json={'password': 'Str0ng!Passw0rd'})
+        self.assertEqual(resp.status_code, 200)
+        body = resp.get_json()
+        self.assertEqual(body['strength'], 90)
+        self.assertEqual(body['label'], 'Strong')
+        self.assertEqual(body['feedback'], [])
+
+    def test_check_password_strength_bulk(self):
+        resp = self.client.post('/api/check_password_strength_bulk', json={'passwords': ['Str0ng!Passw0rd', 'abc']})
+        self.assertEqual(resp.status_code, 200)
+        body = resp.get_json()
+        self.assertEqual(body['scores'], [90, 10])
+        self.assertEqual([body['label_names'][i] for i in body['labels']], ['Strong', 'Weak'])
+        resp = self.client.post('/api/check_password_strength_bulk', json={'passwords': ['abc'], 'packed': True})
+        self.assertEqual(resp.get_json()['scores'], 'Cg==')
+
+
+class TestAppFactory(unittest.TestCase):
+    def test_create_app_config_override(self):
+        test_app = create_app({'DEBUG': False})
+        self.assertFalse(test_app.config['DEBUG'])
+        resp = test_app.test_client().get('/api/session_status')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_crypto_not_imported_at_startup(self):
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        code = "import sys; import backend.app; print('crypto.aes_gcm' in sys.modules, 'cryptography' in sys.modules)"
+        out = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.split(), ['False', 'False'])
+
+    def test_shared_state_backend(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = 'sqlite://' + os.path.join(tmp, 'state.db')
+            worker_a = create_app({'STATE_BACKEND': url}).test_client()
+            worker_b = create_app({'STATE_BACKEND': url}).test_client()
+            worker_a.get('/api/generate_rsa_keys')
+            # worker_a's flusher writes the entry within one flush interval
+            deadline = time.monotonic() + 3
+            status = worker_b.get('/api/session_status').get_json()
+            while status['operations_count'] == 0 and time.monotonic() < deadline:
+                time.sleep(0.1)
+                status = worker_b.get('/api/session_status').get_json()
+            self.assertEqual(status['operations_count'], 1)
+            self.assertEqual(status['metrics']['RSA.success'], 1)
+
+    def test_breach_list_validated_at_startup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(FileNotFoundError):
+                create_app({'BREACH_LIST_PATH': os.path.join(tmp, 'missing.bin')})
+            truncated = os.path.join(tmp, 'truncated.bin')
+            with open(truncated, 'wb') as f:
+                f.write(b'x' * 21)
+            with self.assertRaises(ValueError):
+                create_app({'BREACH_LIST_PATH': truncated})
+
+    def test_warm_up_hooks(self):
+        test_app = create_app({'WARMUP_KEY_POOL': 1, 'WARMUP_KDF': True})
+        # Warm-up runs in a background thread; wait for it before asserting
+        test_app.extensions['warm_up'].join()
+        self.assertEqual(set(test_app.config['KDF_CALIBRATION']), {'fast', 'balanced', 'high'})
+        status = test_app.test_client().get('/api/session_status').get_json()
+        self.assertEqual(status['kdf_calibration'], test_app.config['KDF_CALIBRATION'])
+        resp = test_app.test_client().get('/api/generate_rsa_keys')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('BEGIN PUBLIC KEY', resp.get_json()['public_key'])
+
 if __name__ == '__main__':
     unittest.main()
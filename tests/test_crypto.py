@@ -1,8 +1,10 @@
 import unittest
+import base64
+import json
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from crypto import aes_gcm
+from crypto import aes_gcm, rsa_utils
 
 class TestAESCrypto(unittest.TestCase):
     def test_encrypt_decrypt_text(self):
@@ -27,5 +29,87 @@ class TestAESCrypto(unittest.TestCase):
         with self.assertRaises(Exception):
             aes_gcm.decrypt(ciphertext, wrong)
 
+
+class TestKeyPool(unittest.TestCase):
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_pool_not_shared_with_forked_child(self):
+        rsa_utils.fill_key_pool(1)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if len(rsa_utils._key_pool) == 0 else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(len(rsa_utils._key_pool), 1)
+        rsa_utils.pooled_key_pair()
+
+
+class TestWrappedEnvelope(unittest.TestCase):
+    def test_encrypt_decrypt_wrapped(self):
+        ciphertext = aes_gcm.encrypt_wrapped(b'wrapped payload', 'wrappedpass1', 'fast')
+        self.assertEqual(aes_gcm.decrypt(ciphertext, 'wrappedpass1'), b'wrapped payload')
+        with self.assertRaises(ValueError):
+            aes_gcm.decrypt(ciphertext, 'wrongpass123')
+
+    def test_header_has_no_password_hmac(self):
+        ciphertext = aes_gcm.encrypt_wrapped(b'payload', 'wrappedpass1', 'fast')
+        header = json.loads(base64.b64decode(ciphertext.split('.')[0]))
+        self.assertNotIn('password_hmac', header)
+
+    def test_size_is_authenticated(self):
+        ciphertext = aes_gcm.encrypt_wrapped(b'payload', 'wrappedpass1', 'fast')
+        header_b64, payload_b64 = ciphertext.split('.')
+        header = json.loads(base64.b64decode(header_b64))
+        header['size'] = 1
+        forged = base64.b64encode(json.dumps(header).encode()).decode() + '.' + payload_b64
+        with self.assertRaises(ValueError):
+            aes_gcm.decrypt(forged, 'wrappedpass1')
+
+    def test_inspect_without_password(self):
+        ciphertext = aes_gcm.encrypt_wrapped(b'x' * 100, 'inspectpass1', 'fast')
+        info = aes_gcm.inspect(ciphertext)
+        self.assertTrue(info['wrapped'])
+        self.assertEqual((info['profile'], info['iterations'], info['size']), ('fast', aes_gcm.PBKDF2_ITERATIONS_FAST, 100))
+        legacy = aes_gcm.inspect(aes_gcm.encrypt(b'x' * 100, 'inspectpass1', 'fast'))
+        self.assertFalse(legacy['wrapped'])
+        self.assertEqual(legacy['size'], 100)
+
+    def test_rekey_keeps_payload(self):
+        ciphertext = aes_gcm.encrypt_wrapped(b'rotate me', 'oldpassword1', 'fast')
+        rekeyed = aes_gcm.rekey(ciphertext, 'oldpassword1', 'newpassword1', 'balanced')
+        self.assertEqual(rekeyed.split('.')[1], ciphertext.split('.')[1])
+        self.assertEqual(aes_gcm.inspect(rekeyed)['profile'], 'balanced')
+        self.assertEqual(aes_gcm.decrypt(rekeyed, 'newpassword1'), b'rotate me')
+        with self.assertRaises(ValueError):
+            aes_gcm.decrypt(rekeyed, 'oldpassword1')
+
+    def test_wrapped_key_bound_to_payload(self):
+        a = aes_gcm.encrypt_wrapped(b'payload a', 'samepassword', 'fast')
+        b = aes_gcm.encrypt_wrapped(b'payload b', 'samepassword', 'fast')
+        with self.assertRaises(ValueError):
+            aes_gcm.decrypt(a.split('.')[0] + '.' + b.split('.')[1], 'samepassword')
+
+    def test_rekey_many_migrates_legacy(self):
+        envelopes = [
+            aes_gcm.encrypt(b'legacy', 'oldpassword1', 'fast'),
+            aes_gcm.encrypt_wrapped(b'wrapped', 'oldpassword1', 'fast'),
+            aes_gcm.encrypt_wrapped(b'other', 'otherpass123', 'fast'),
+        ]
+        result = aes_gcm.rekey_many(envelopes, 'oldpassword1', 'newpassword1')
+        self.assertEqual((result['migrated'], result['rewrapped']), (1, 1))
+        self.assertEqual([index for index, _ in result['errors']], [2])
+        self.assertIsNone(result['envelopes'][2])
+        self.assertEqual(aes_gcm.decrypt(result['envelopes'][0], 'newpassword1'), b'legacy')
+        self.assertTrue(aes_gcm.inspect(result['envelopes'][0])['wrapped'])
+
+    def test_malformed_envelopes_rejected(self):
+        for bad in (123, base64.b64encode(b'[]').decode(), base64.b64encode(b'{"metadata": []}').decode(),
+                    base64.b64encode(b'{"metadata": {}, "ciphertext": 5}').decode()):
+            with self.assertRaises(ValueError):
+                aes_gcm.inspect(bad)
+            with self.assertRaises(ValueError):
+                aes_gcm.rekey(bad, 'oldpassword1', 'newpassword1')
+        result = aes_gcm.rekey_many([123, base64.b64encode(b'[]').decode()], 'oldpassword1', 'newpassword1')
+        self.assertEqual([index for index, _ in result['errors']], [0, 1])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import password_strength
+from backend.password_strength import BreachList, score_password, score_passwords
+
+
+class TestPasswordStrength(unittest.TestCase):
+    def test_score_password(self):
+        self.assertEqual(tuple(score_password('Str0ng!Passw0rd')), (90, 'Strong', []))
+        self.assertEqual(tuple(score_password('abcdefgh')), (25, 'Weak', [
+            'Add uppercase letters', 'Add numbers', 'Add special characters']))
+        self.assertEqual(score_password('short')[2][0], 'Use at least 8 characters (12+ recommended)')
+
+    def test_non_ascii_and_control_characters_ignored(self):
+        self.assertEqual(score_password('\x01\x02\x04\x08éü€'), score_password('\x00\x00\x00\x00\x00\x00\x00'))
+
+    def test_score_passwords_matches_single(self):
+        passwords = ['', 'password', 'Password1', 'Password1!', 'correct horse battery staple', 'Aa1!Aa1!Aa1!']
+        result = score_passwords(passwords)
+        for i, password in enumerate(passwords):
+            single = score_password(password)
+            self.assertEqual(result.scores[i], single.score)
+            self.assertEqual(password_strength.LABELS[result.labels[i]], single.label)
+            self.assertEqual(password_strength.feedback_messages(result.feedback[i]), single.feedback)
+
+    def test_breach_list(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'breached.bin')
+            self.assertEqual(BreachList.build(['P@ssw0rd1234', 'letmein', 'letmein'], path), 2)
+            breach_list = BreachList(path)
+            self.assertEqual(len(breach_list), 2)
+            self.assertIn('letmein', breach_list)
+            self.assertNotIn('Un1que!Passphrase', breach_list)
+            result = score_password('P@ssw0rd1234', breach_list)
+            self.assertEqual(result.score, 0)
+            self.assertIn('Password appears in a known breach list', result.feedback)
+            self.assertNotIn('\ud800', breach_list)
+            breach_list.close()
+
+    def test_breach_list_lone_surrogates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'breached.bin')
+            BreachList.build(['\ud800abc'], path)
+            breach_list = BreachList(path)
+            self.assertIn('\ud800abc', breach_list)
+            self.assertEqual(score_passwords(['\ud800abc', '\udfff'], breach_list).scores.tolist()[0], 0)
+            breach_list.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+import unittest
+import abc
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import state
+from crypto import aes_gcm
+
+
+class _Simple(str):
+    """RESP simple string reply."""
+
+
+class _Error(str):
+    """RESP error reply."""
+
+
+class _RESPHandler(socketserver.StreamRequestHandler):
+    """Minimal Redis-protocol stand-in covering the commands RedisStore uses.
+
+    Commands named in server.fail_once get one error reply each.
+    """
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, _Simple):
+            self.wfile.write(b'+%s\r\n' % value.encode())
+        elif isinstance(value, _Error):
+            self.wfile.write(b'-%s\r\n' % value.encode())
+        elif isinstance(value, int):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, list):
+            self.wfile.write(b'*%d\r\n' % len(value))
+            for item in value:
+                self.reply(item)
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def run(self, args):
+        data, server = self.server.data, self.server
+        cmd, key, rest = args[0].upper(), args[1], args[2:]
+        if cmd in server.fail_once:
+            server.fail_once.discard(cmd)
+            return _Error('ERR injected failure')
+        if cmd == b'RPUSH':
+            data.setdefault(key, []).extend(rest)
+            return len(data[key])
+        if cmd == b'LTRIM':
+            items, start, end = data.get(key, []), int(rest[0]), int(rest[1])
+            data[key] = items[start:len(items) + end + 1 if end < 0 else end + 1]
+            return _Simple('OK')
+        if cmd == b'LRANGE':
+            return list(data.get(key, []))
+        if cmd == b'HINCRBY':
+            h = data.setdefault(key, {})
+            h[rest[0]] = h.get(rest[0], 0) + int(rest[1])
+            return h[rest[0]]
+        if cmd == b'HGETALL':
+            return [x for k, v in data.get(key, {}).items() for x in (k, str(v).encode())]
+        if cmd == b'GET':
+            expires = server.expires.get(key)
+            if expires is not None and expires < time.time():
+                data.pop(key, None)
+            return data.get(key)
+        if cmd == b'SET':
+            data[key] = rest[0]
+            if len(rest) == 3 and rest[1].upper() == b'PX':
+                server.expires[key] = time.time() + int(rest[2]) / 1000
+            return _Simple('OK')
+        return _Error(f'ERR unknown command {cmd.decode()}')
+
+    def handle(self):
+        authenticated = False
+        queued = None  # commands inside MULTI
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            cmd = args[0].upper()
+            if cmd == b'AUTH':
+                authenticated = args[-1] == self.server.password
+                self.reply(_Simple('OK') if authenticated else _Error('WRONGPASS invalid password'))
+            elif self.server.password and not authenticated:
+                self.reply(_Error('NOAUTH Authentication required.'))
+            elif cmd == b'MULTI':
+                queued = []
+                self.reply(_Simple('OK'))
+            elif cmd == b'EXEC':
+                self.reply([self.run(a) for a in queued])
+                queued = None
+            elif queued is not None:
+                queued.append(args)
+                self.reply(_Simple('QUEUED'))
+            else:
+                self.reply(self.run(args))
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return predicate()
+
+
+class StoreContract(abc.ABC):
+    @abc.abstractmethod
+    def make_store(self, **kwargs):
+        """Return a fresh store for the backend under test."""
+
+    def test_log_is_trimmed_and_ordered(self):
+        store = self.make_store(log_limit=3)
+        for i in range(5):
+            store.append_log({'n': i})
+        self.assertEqual([e['n'] for e in store.get_log()], [2, 3, 4])
+
+    def test_counters(self):
+        store = self.make_store()
+        store.incr('operations_total')
+        store.incr('operations_total', 2)
+        self.assertEqual(store.get_counters(), {'operations_total': 3})
+
+    def test_cache(self):
+        store = self.make_store()
+        self.assertIsNone(store.cache_get('missing'))
+        store.cache_set('calibration', {'fast': 0.1})
+        self.assertEqual(store.cache_get('calibration'), {'fast': 0.1})
+
+    def test_cache_expiry(self):
+        store = self.make_store()
+        store.cache_set('short', 'secret', ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(store.cache_get('short'))
+
+    def test_derived_key_cache(self):
+        store = self.make_store()
+        cache = state.DerivedKeyCache(store, ttl=60)
+        ciphertext = aes_gcm.encrypt(b'cached', 'cachepass123', 'fast')
+        self.assertEqual(aes_gcm.decrypt(ciphertext, 'cachepass123', key_cache=cache), b'cached')
+        self.assertEqual(aes_gcm.decrypt(ciphertext, 'cachepass123', key_cache=cache), b'cached')
+        with self.assertRaises(ValueError):
+            aes_gcm.decrypt(ciphertext, 'wrongpass123', key_cache=cache)
+        wrapped = aes_gcm.encrypt_wrapped(b'cached', 'cachepass123', 'fast')
+        self.assertEqual(aes_gcm.decrypt(wrapped, 'cachepass123', key_cache=cache), b'cached')
+        self.assertEqual(aes_gcm.decrypt(wrapped, 'cachepass123', key_cache=cache), b'cached')
+        with self.assertRaises(ValueError):
+            aes_gcm.decrypt(wrapped, 'wrongpass123', key_cache=cache)
+
+
+class TestStateStoreBase(unittest.TestCase):
+    def test_missing_hooks_fail_at_creation(self):
+        class Incomplete(state.StateStore):
+            def _read_log(self):
+                return []
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class TestMemoryStore(StoreContract, unittest.TestCase):
+    def make_store(self, **kwargs):
+        return state.create_store('memory://', **kwargs)
+
+    def test_cache_bounded(self):
+        store = self.make_store()
+        for i in range(state.MEMORY_CACHE_LIMIT + 10):
+            store.cache_set(str(i), i)
+        self.assertEqual(len(store._cache), state.MEMORY_CACHE_LIMIT)
+        self.assertIsNone(store.cache_get('0'))
+
+
+    def test_cache_concurrent_writers(self):
+        store = self.make_store()
+        errors = []
+
+        def writer(offset):
+            try:
+                for i in range(2000):
+                    store.cache_set(f'{offset}:{i}', i, ttl=0.001 if i % 2 else None)
+                    store.cache_get(f'{offset}:{i - 1}')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+
+class TestSQLiteStore(StoreContract, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'state.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_store(self, **kwargs):
+        return state.create_store('sqlite://' + self.path, **kwargs)
+
+    def test_expired_cache_rows_deleted(self):
+        store = self.make_store()
+        store.cache_set('a', 'secret', ttl=0.05)
+        store.cache_set('b', 'secret', ttl=0.05)
+        time.sleep(0.1)
+        store.cache_get('a')  # expired on read
+        store.cache_set('c', 'fresh')  # sweeps 'b'
+        rows = store._conn().execute('SELECT key FROM cache').fetchall()
+        self.assertEqual(rows, [('c',)])
+
+    def test_shared_between_stores(self):
+        writer = self.make_store(batch_size=2)
+        reader = self.make_store()
+        writer.append_log({'n': 1})
+        self.assertEqual(reader.get_log(), [])  # still buffered in the writer
+        writer.append_log({'n': 2})  # full batch wakes the flusher
+        self.assertTrue(wait_for(lambda: len(reader.get_log()) == 2, timeout=0.5))
+        self.assertEqual([e['n'] for e in reader.get_log()], [1, 2])
+
+    def test_idle_writer_flushed_after_interval(self):
+        writer = self.make_store(flush_interval=0.2)
+        reader = self.make_store()
+        for i in range(3):
+            writer.append_log({'n': i})
+        time.sleep(0.5)
+        self.assertEqual([e['n'] for e in reader.get_log()], [0, 1, 2])
+
+
+class TestRedisStore(StoreContract, unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _RESPHandler)
+        self.server.daemon_threads = True
+        self.server.data = {}
+        self.server.expires = {}
+        self.server.password = None
+        self.server.fail_once = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_store(self, **kwargs):
+        host, port = self.server.server_address
+        return state.create_store(f'redis://{host}:{port}/0', **kwargs)
+
+    def test_auth_from_url(self):
+        self.server.password = b's3cret/pw'
+        host, port = self.server.server_address
+        store = state.create_store(f'redis://:s3cret%2Fpw@{host}:{port}/0')
+        store.cache_set('k', 'v')
+        self.assertEqual(store.cache_get('k'), 'v')
+        wrong = state.create_store(f'redis://:nope@{host}:{port}/0')
+        with self.assertRaises(RuntimeError):
+            wrong.cache_get('k')
+
+    def test_partial_batch_not_duplicated_on_retry(self):
+        store = self.make_store(flush_interval=60)  # keep the background flusher out of the way
+        store.append_log({'n': 1})
+        store.incr('ops')
+        self.server.fail_once.add(b'HINCRBY')
+        with self.assertRaises(state.PartialWriteError):
+            store.flush()
+        store.flush()
+        self.assertEqual(store.get_log(), [{'n': 1}])
+        self.assertEqual(store.get_counters(), {'ops': 1})
+
+    def test_error_reply_keeps_pipeline_in_sync(self):
+        store = self.make_store()
+        store.cache_set('a', 'value')
+        self.server.fail_once.add(b'RPUSH')
+        with self.assertRaises(state.StateServerError):
+            store.execute(('RPUSH', 'x', 'y'), ('LTRIM', 'x', 0, -1))
+        # The LTRIM reply must not leak into the next command
+        self.assertEqual(store.cache_get('a'), 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()